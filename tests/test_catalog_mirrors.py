@@ -0,0 +1,88 @@
+import http.server
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir,
+                                "usr/lib/enigma2/python/Plugins/Extensions/CiefpIPTVBouquets"))
+
+import core
+
+FILES = {
+    "userbouquet.iptv_a.tv": "#NAME A\n#SERVICE 4097:0:1:0:0:0:0:0:0:0:http%3a//h/1:A1\n",
+    "userbouquet.iptv_b.tv": "#NAME B\n#SERVICE 4097:0:1:0:0:0:0:0:0:0:http%3a//h/2:B1\n",
+}
+
+def serve(list_delay=0, fetch_delay=0):
+    """Start a catalog server that lists FILES as an HTML index."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = self.path.strip("/")
+            time.sleep(fetch_delay if name else list_delay)
+            if name:
+                body = FILES[name]
+            else:
+                body = "".join(f'<a href="{name}">{name}</a>\n' for name in FILES)
+            try:
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(body.encode("utf-8"))
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+def dead_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/"
+
+@pytest.fixture
+def servers(monkeypatch):
+    monkeypatch.setattr(core, "CATALOG_TIMEOUT", (1, 1))
+    staller, staller_url = serve(fetch_delay=5)
+    slow, slow_url = serve(list_delay=0.3)
+    yield staller_url, slow_url
+    for server in (staller, slow):
+        server.shutdown()
+        server.server_close()
+
+def test_install_fails_over_to_healthy_source(servers, tmp_path):
+    staller_url, slow_url = servers
+    mirrors = core.CatalogMirrors([dead_port(), staller_url, slow_url])
+
+    # The staller lists fastest and wins the race, then stalls every download
+    source, listing = mirrors.select()
+    assert source.location == staller_url
+    assert sorted(listing) == sorted(FILES)
+
+    started = time.monotonic()
+    bouquets = [{"filename": filename, "source": source.name} for filename in sorted(FILES)]
+    result = core.install_bouquets(bouquets, path=str(tmp_path) + "/", picons=False, mirrors=mirrors)
+
+    assert time.monotonic() - started < 5
+    assert result["installed"] == sorted(FILES)
+    assert set(result["sources"].values()) == {core.catalog_source(slow_url).name}
+    for filename, content in FILES.items():
+        assert (tmp_path / filename).read_text() == content
+    assert all(f'"{filename}"' in (tmp_path / "bouquets.tv").read_text() for filename in FILES)
+
+def test_catalog_reports_serving_source(servers):
+    staller_url, slow_url = servers
+    mirrors = core.CatalogMirrors([dead_port(), staller_url, slow_url])
+    bouquet_files, bouquet_list = core.fetch_catalog(mirrors=mirrors)
+    assert sorted(bouquet_list) == ["A", "B"]
+    assert {info["source"] for info in bouquet_files.values()} == {core.catalog_source(slow_url).name}
+
+def test_no_source_available():
+    with pytest.raises(IOError):
+        core.CatalogMirrors([dead_port()]).select()
@@ -0,0 +1,204 @@
+"""Command line interface for provisioning receivers over SSH.
+
+Runs outside enigma2 and uses the same functions as the plugin screens:
+
+    python cli.py list
+    python cli.py installed
+    python cli.py install "Bouquet A" userbouquet.b.tv
+    python cli.py --source http://192.168.1.10:8000/ install --all
+    python cli.py delete userbouquet.b.tv
+    python cli.py edit userbouquet.b.tv --delete "DE:" "24/7 "
+    python cli.py edit userbouquet.b.tv --sort episode
+    python cli.py snapshot
+    python cli.py snapshots
+    python cli.py restore snapshot-20250101-120000.zip
+    python cli.py prune --keep 5
+    python cli.py reload
+
+Every command prints one JSON object with its result and timings.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core import (
+    BOUQUET_PATH, WEBIF_RELOAD_URL, CatalogMirrors, create_snapshot, delete_bouquets, fetch_catalog,
+    SORT_MODES, install_bouquets, list_iptv_bouquets, list_snapshots, prune_snapshots,
+    read_bouquet, reload_service_lists, restore_snapshot, sort_channels, write_bouquet
+)
+
+def resolve_catalog(names, install_all, mirrors):
+    bouquet_files, bouquet_list = fetch_catalog(mirrors=mirrors)
+    if install_all:
+        return [bouquet_files[name] for name in bouquet_list]
+    by_filename = dict((info["filename"], info) for info in bouquet_files.values())
+    selected = []
+    for name in names:
+        info = bouquet_files.get(name) or by_filename.get(name)
+        if not info:
+            raise ValueError(f"Bouquet not found in catalog: {name}")
+        selected.append(info)
+    return selected
+
+def resolve_installed(names):
+    installed = list_iptv_bouquets()
+    by_name = dict((display_name, filename) for filename, display_name in installed)
+    filenames = set(filename for filename, display_name in installed)
+    selected = []
+    for name in names:
+        if name in filenames:
+            selected.append(name)
+        elif name in by_name:
+            selected.append(by_name[name])
+        else:
+            raise ValueError(f"Bouquet not installed: {name}")
+    return selected
+
+def cmd_list(args, result):
+    bouquet_files, bouquet_list = fetch_catalog(mirrors=args.mirrors)
+    result["bouquets"] = [
+        {"name": name, "filename": bouquet_files[name]["filename"]} for name in bouquet_list
+    ]
+
+def cmd_installed(args, result):
+    result["bouquets"] = [
+        {"name": display_name, "filename": filename} for filename, display_name in list_iptv_bouquets()
+    ]
+
+def cmd_install(args, result):
+    started = time.monotonic()
+    bouquets = resolve_catalog(args.bouquets, args.all, args.mirrors)
+    result["timings"]["catalog"] = time.monotonic() - started
+    installed = install_bouquets(bouquets, picons=not args.no_picons, mirrors=args.mirrors)
+    result["installed"] = installed["installed"]
+    result["sources"] = installed["sources"]
+    result["timings"].update(installed["timings"])
+    if "picons" in installed:
+        fetched, present, failed = installed["picons"]
+        result["picons"] = {"fetched": fetched, "present": present, "failed": failed}
+    if "picon_error" in installed:
+        result["picon_error"] = installed["picon_error"]
+
+def cmd_delete(args, result):
+    filenames = resolve_installed(args.bouquets)
+    result["deleted"] = filenames
+    delete_bouquets(filenames)
+
+def cmd_edit(args, result):
+    filename = resolve_installed([args.bouquet])[0]
+    bouquet_path = os.path.join(BOUQUET_PATH, filename)
+    bouquet_name, channels = read_bouquet(bouquet_path)
+    prefixes = tuple(args.delete)
+    kept = [
+        channel for channel in channels
+        if not (prefixes and (channel["description"] or channel["service"]).startswith(prefixes))
+    ]
+    result["removed"] = len(channels) - len(kept)
+    if args.sort:
+        started = time.monotonic()
+        kept = sort_channels(kept, args.sort)
+        result["timings"]["sort"] = time.monotonic() - started
+    if kept != channels:
+        write_bouquet(bouquet_path, bouquet_name, kept)
+
+def cmd_snapshot(args, result):
+    archive_name, files, stored = create_snapshot()
+    result["snapshot"] = archive_name
+    result["files"] = files
+    result["stored"] = stored
+
+def cmd_snapshots(args, result):
+    result["snapshots"] = [
+        {"name": name, "created": manifest["created"], "files": len(manifest["files"])}
+        for name, manifest in list_snapshots()
+    ]
+
+def cmd_restore(args, result):
+    result["restored"] = restore_snapshot(args.snapshot)
+
+def cmd_prune(args, result):
+    result["deleted"] = prune_snapshots(args.keep)
+
+COMMANDS = {
+    "list": cmd_list,
+    "installed": cmd_installed,
+    "install": cmd_install,
+    "delete": cmd_delete,
+    "edit": cmd_edit,
+    "snapshot": cmd_snapshot,
+    "snapshots": cmd_snapshots,
+    "restore": cmd_restore,
+    "prune": cmd_prune,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli.py", description="CiefpIPTVBouquets command line")
+    parser.add_argument("--webif", default=WEBIF_RELOAD_URL, help="service list reload URL")
+    parser.add_argument("--source", action="append", metavar="URL_OR_DIR",
+                        help="catalog source to use instead of the configured ones (repeatable)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    commands.add_parser("list", help="list the bouquets in the catalog")
+    commands.add_parser("installed", help="list the installed IPTV bouquets")
+
+    install = commands.add_parser("install", help="install catalog bouquets by name or filename")
+    install.add_argument("bouquets", nargs="*")
+    install.add_argument("--all", action="store_true", help="install every catalog bouquet")
+    install.add_argument("--no-picons", action="store_true", help="skip the picon stage")
+    install.add_argument("--no-reload", action="store_true")
+
+    delete = commands.add_parser("delete", help="delete installed bouquets by name or filename")
+    delete.add_argument("bouquets", nargs="+")
+    delete.add_argument("--no-reload", action="store_true")
+
+    edit = commands.add_parser("edit", help="remove or sort channels of a bouquet and save it")
+    edit.add_argument("bouquet")
+    edit.add_argument("--delete", nargs="+", default=[], metavar="PREFIX",
+                      help="remove channels whose name starts with PREFIX")
+    edit.add_argument("--sort", choices=[mode for mode, label in SORT_MODES])
+    edit.add_argument("--no-reload", action="store_true")
+
+    commands.add_parser("snapshot", help="snapshot all IPTV bouquets and bouquets.tv")
+    commands.add_parser("snapshots", help="list snapshots, newest first")
+
+    restore = commands.add_parser("restore", help="restore a snapshot")
+    restore.add_argument("snapshot")
+    restore.add_argument("--no-reload", action="store_true")
+
+    prune = commands.add_parser("prune", help="delete old snapshots that newer ones do not depend on")
+    prune.add_argument("--keep", type=int, default=5, help="number of newest snapshots to keep")
+
+    commands.add_parser("reload", help="reload service lists and bouquets")
+
+    args = parser.parse_args(argv)
+    if args.command == "install" and not (args.bouquets or args.all):
+        parser.error("install needs bouquet names or --all")
+    if args.command == "edit" and not (args.delete or args.sort):
+        parser.error("edit needs --delete or --sort")
+
+    args.mirrors = CatalogMirrors(args.source) if args.source else None
+
+    result = {"command": args.command, "ok": True, "timings": {}}
+    started = time.monotonic()
+    try:
+        if args.command in COMMANDS:
+            COMMANDS[args.command](args, result)
+        if args.command == "reload" or (args.command in ("install", "delete", "edit", "restore") and not args.no_reload):
+            reload_started = time.monotonic()
+            reload_service_lists(args.webif)
+            result["timings"]["reload"] = time.monotonic() - reload_started
+    except Exception as e:
+        result["ok"] = False
+        result["error"] = str(e)
+    result["timings"]["total"] = time.monotonic() - started
+
+    print(json.dumps(result, indent=2))
+    return 0 if result["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
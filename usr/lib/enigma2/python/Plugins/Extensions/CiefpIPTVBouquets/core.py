@@ -0,0 +1,1464 @@
+import os
+import hashlib
+from array import array
+from itertools import accumulate
+import heapq
+import json
+import pickle
+import queue
+import re
+import shutil
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from operator import itemgetter
+from urllib.parse import quote, unquote, urljoin
+import requests
+
+PLUGIN_VERSION = "1.7" 
+PLUGIN_NAME = "CiefpIPTVBouquets"
+PLUGIN_DESCRIPTION = "Enigma2 IPTV Bouquets"
+GITHUB_API_URL = "https://api.github.com/repos/ciefp/CiefpIPTV/contents/"
+BOUQUET_PATH = "/etc/enigma2/"
+# Catalog sources, fastest healthy one wins. Each entry is a GitHub
+# contents API URL, an HTTP directory (JSON or HTML listing) or a local
+# directory. One source per line in CATALOG_SOURCES_PATH overrides these.
+CATALOG_SOURCES = [GITHUB_API_URL]
+CATALOG_SOURCES_PATH = os.path.join(BOUQUET_PATH, "ciefpiptv_sources.conf")
+CATALOG_SOURCE_TTL = 3600
+CATALOG_TIMEOUT = (5, 15)
+# Plugin data that does not belong in the settings directory
+DATA_PATH = "/home/root/CiefpIPTVBouquets/"
+INDEX_PATH = os.path.join(DATA_PATH, "channels.index")
+PICON_PATH = "/usr/share/enigma2/picon/"
+PICON_BASE_URL = "https://raw.githubusercontent.com/ciefp/CiefpIPTV/main/picon/"
+PICON_CACHE_MAX_BYTES = 20 * 1024 * 1024
+PICON_WORKERS = 4
+# Picons the server does not have are not asked for again for a week
+PICON_MISS_TTL = 7 * 24 * 3600
+WEBIF_RELOAD_URL = "http://127.0.0.1/web/servicelistreload?mode=0"
+SNAPSHOT_PATH = os.path.join(DATA_PATH, "snapshots/")
+SPLIT_ORDER_PATH = os.path.join(DATA_PATH, "splits/")
+
+# Jobs that can run at the same time; writes still go one at a time
+JOB_WORKERS = 3
+
+# Held by every job that writes into BOUQUET_PATH so bouquets.tv and the
+# userbouquet files are never rewritten by two jobs at the same time.
+bouquet_write_lock = threading.RLock()
+
+class JobCancelled(Exception):
+    pass
+
+class Job(object):
+    def __init__(self, job_queue, owner, func, args, on_done, on_error, on_progress):
+        self.job_queue = job_queue
+        self.owner = owner
+        self.func = func
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, text):
+        # Called from the worker thread, delivered on the main loop
+        if self.on_progress and not self.cancelled:
+            self.job_queue.dispatch(self, self.on_progress, text)
+
+class JobQueue(object):
+    """Runs blocking network and disk work on a small pool of worker threads.
+
+    Jobs start in submission order on the first free worker, so a long
+    picon download does not hold up a bouquet load or a search index
+    update. Jobs that write into BOUQUET_PATH serialize themselves with
+    bouquet_write_lock. Callbacks are handed back to the enigma2 main loop
+    by polling with an eTimer, or through ``dispatcher`` when one is given
+    (a callable taking a no-argument function to run on the caller's
+    thread).
+    """
+
+    POLL_INTERVAL = 100
+
+    def __init__(self, dispatcher=None, workers=JOB_WORKERS):
+        self.dispatcher = dispatcher
+        self.pending = queue.Queue()
+        self.completed = queue.Queue()
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.max_workers = workers
+        self.workers = []
+        self.timer = None
+        self.timer_conn = None
+
+    def submit(self, owner, func, *args, on_done=None, on_error=None, on_progress=None):
+        job = Job(self, owner, func, args, on_done, on_error, on_progress)
+        with self.lock:
+            self.jobs.append(job)
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            if len(self.workers) < min(len(self.jobs), self.max_workers):
+                worker = threading.Thread(target=self.run, name=f"{PLUGIN_NAME}-jobs-{len(self.workers) + 1}")
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        self.pending.put(job)
+        self.start_polling()
+        return job
+
+    def cancel_owner(self, owner):
+        with self.lock:
+            for job in self.jobs:
+                if job.owner is owner:
+                    job.cancel()
+
+    def run(self):
+        while True:
+            job = self.pending.get()
+            try:
+                if job.cancelled:
+                    continue
+                try:
+                    result = job.func(job, *job.args)
+                except JobCancelled:
+                    continue
+                except Exception as e:
+                    if job.on_error:
+                        self.dispatch(job, job.on_error, e)
+                    continue
+                if job.on_done:
+                    self.dispatch(job, job.on_done, result)
+            finally:
+                with self.lock:
+                    self.jobs.remove(job)
+
+    def dispatch(self, job, callback, *args):
+        if self.dispatcher is not None:
+            self.dispatcher(lambda: self.deliver(job, callback, args))
+        else:
+            self.completed.put((job, callback, args))
+
+    def deliver(self, job, callback, args):
+        if callback is not None and not job.cancelled:
+            callback(*args)
+
+    def start_polling(self):
+        if self.dispatcher is not None:
+            return
+        if self.timer is None:
+            from enigma import eTimer
+            self.timer = eTimer()
+            try:
+                self.timer.callback.append(self.poll)
+            except AttributeError:
+                self.timer_conn = self.timer.timeout.connect(self.poll)
+        if not self.timer.isActive():
+            self.timer.start(self.POLL_INTERVAL, False)
+
+    def poll(self):
+        while True:
+            try:
+                job, callback, args = self.completed.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.deliver(job, callback, args)
+            except Exception as e:
+                print(f"[{PLUGIN_NAME}] Job callback failed: {str(e)}")
+        with self.lock:
+            idle = not self.jobs
+        if idle and self.completed.empty():
+            self.timer.stop()
+
+job_queue = JobQueue()
+
+GARBAGE_CATEGORIES = [
+    ("del", "Deleted (.del) files"),
+    ("orphaned", "Orphaned bouquets"),
+    ("empty", "Empty bouquets"),
+    ("dangling", "Broken bouquet references"),
+]
+
+def bouquet_reference(line):
+    """Return the file named by a FROM BOUQUET service line, or None."""
+    if "#SERVICE" in line and "FROM BOUQUET" in line:
+        start = line.find('"') + 1
+        end = line.find('"', start)
+        if start > 0 and end > start:
+            return line[start:end]
+    return None
+
+def bouquet_service_line(filename):
+    return f'#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "{filename}" ORDER BY bouquet\n'
+
+def replace_file(path, lines):
+    """Write lines to a temporary file and rename it over path."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", errors="surrogateescape") as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+
+def replace_file_bytes(path, content):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def is_bouquet_list(filename):
+    """True for the top-level bouquets.tv and bouquets.radio files."""
+    return filename.startswith("bouquets.") and filename.endswith((".tv", ".radio"))
+
+def is_userbouquet(filename):
+    return filename.startswith("userbouquet.") and filename.endswith((".tv", ".radio"))
+
+# enigma2's own bouquets, empty until the user adds channels to them
+PROTECTED_BOUQUETS = ["userbouquet.favourites.tv", "userbouquet.favourites.radio"]
+
+def rewrite_bouquets_tv(replacements, path=BOUQUET_PATH):
+    """Swap bouquets.tv entries in a single atomic rewrite.
+
+    replacements maps a referenced filename to the filenames that take its
+    place (an empty list drops the entry). Filenames that are not listed
+    yet are appended. Returns the number of entries dropped. Callers must
+    hold bouquet_write_lock.
+    """
+    return rewrite_bouquet_references(os.path.join(path, "bouquets.tv"), replacements)
+
+def rewrite_bouquet_references(bouquets_tv_path, replacements):
+    """rewrite_bouquets_tv for any file holding FROM BOUQUET lines.
+
+    Undecodable bytes in channel names are carried through unchanged.
+    """
+    lines = []
+    if os.path.exists(bouquets_tv_path):
+        with open(bouquets_tv_path, "r", errors="surrogateescape") as f:
+            lines = f.readlines()
+
+    new_lines = []
+    done = set()
+    dropped = 0
+    for line in lines:
+        filename = bouquet_reference(line)
+        if filename not in replacements:
+            new_lines.append(line)
+            continue
+        if filename in done:
+            dropped += 1
+            continue
+        done.add(filename)
+        if not replacements[filename]:
+            dropped += 1
+        for new_filename in replacements[filename]:
+            new_lines.append(bouquet_service_line(new_filename))
+
+    for filename, new_filenames in replacements.items():
+        if filename not in done:
+            new_lines.extend(bouquet_service_line(n) for n in new_filenames)
+
+    if new_lines != lines:
+        replace_file(bouquets_tv_path, new_lines)
+    return dropped
+
+def format_size(size):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} GB"
+
+def scan_bouquet_garbage(path=BOUQUET_PATH):
+    """Find everything in the bouquet store that can be removed.
+
+    The directory is listed once with os.scandir and every bouquets.* list
+    and userbouquet is read once. Returns a dict mapping each
+    GARBAGE_CATEGORIES key to a list of (filename, reclaimable bytes)
+    tuples. Dangling entries are FROM BOUQUET lines, top-level or nested,
+    that point at a missing file.
+    """
+    garbage = dict((key, []) for key, label in GARBAGE_CATEGORIES)
+
+    sizes = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                sizes[entry.name] = entry.stat().st_size
+
+    top_level = {}
+    nested = {}
+    empty = []
+    for name in sorted(sizes):
+        if name.endswith(".del"):
+            garbage["del"].append((name, sizes[name]))
+            continue
+        if is_bouquet_list(name):
+            references = top_level
+        elif is_userbouquet(name):
+            references = nested
+        else:
+            continue
+        has_services = False
+        try:
+            with open(os.path.join(path, name), "r", errors="ignore") as f:
+                for line in f:
+                    if line.startswith("#SERVICE"):
+                        has_services = True
+                        filename = bouquet_reference(line)
+                        if filename:
+                            references[filename] = references.get(filename, 0) + len(line.encode("utf-8"))
+        except (IOError, OSError):
+            continue
+        if references is nested and not has_services:
+            empty.append(name)
+
+    for name in empty:
+        # Removing an empty sub-bouquet would leave its parent pointing at
+        # nothing, so only top-level and unreferenced ones are collected
+        if name not in nested and name not in PROTECTED_BOUQUETS:
+            garbage["empty"].append((name, sizes[name] + top_level.get(name, 0)))
+
+    empty = set(empty)
+    for name, size in sizes.items():
+        if (is_userbouquet(name) and name not in empty and name not in top_level and name not in nested
+                and name not in PROTECTED_BOUQUETS):
+            garbage["orphaned"].append((name, size))
+
+    for references in (top_level, nested):
+        for name, size in references.items():
+            if name not in sizes:
+                garbage["dangling"].append((name, size))
+
+    for key, items in garbage.items():
+        # A file referenced from both levels is reported once
+        merged = {}
+        for name, size in items:
+            merged[name] = merged.get(name, 0) + size
+        garbage[key] = sorted(merged.items())
+    return garbage
+
+def garbage_report(garbage, names=5):
+    """Summarise a scan, naming up to names files per category."""
+    lines = []
+    total = 0
+    for key, label in GARBAGE_CATEGORIES:
+        size = sum(item[1] for item in garbage[key])
+        total += size
+        lines.append(f"{label}: {len(garbage[key])} ({format_size(size)})")
+        for name, item_size in garbage[key][:names]:
+            lines.append(f"  {name}")
+        if len(garbage[key]) > names:
+            lines.append(f"  ... and {len(garbage[key]) - names} more")
+    lines.append(f"Reclaimable: {format_size(total)}")
+    return "\n".join(lines)
+
+def apply_bouquet_garbage(garbage, path=BOUQUET_PATH):
+    """Remove everything found by scan_bouquet_garbage in one batch.
+
+    Every bouquets.* list and userbouquet that refers to a dropped file is
+    rewritten at most once, through a temporary file that replaces the
+    original atomically, before any bouquet file is removed.
+    """
+    dropped = set(name for name, size in garbage["empty"] + garbage["dangling"])
+    removed = 0
+
+    with bouquet_write_lock:
+        if dropped:
+            replacements = dict((name, []) for name in dropped)
+            with os.scandir(path) as entries:
+                containers = [
+                    entry.name for entry in entries
+                    if entry.name not in dropped and (is_bouquet_list(entry.name) or is_userbouquet(entry.name))
+                ]
+            for name in containers:
+                removed += rewrite_bouquet_references(os.path.join(path, name), replacements)
+
+        for key in ("del", "orphaned", "empty"):
+            for name, size in garbage[key]:
+                try:
+                    os.remove(os.path.join(path, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        remove_split_orders([name for name, size in garbage["orphaned"] + garbage["empty"]], path)
+    return removed
+
+SPLIT_MAX_ENTRIES = 2000
+SPLIT_NAME_RE = re.compile(r"(.*) \[\d+/\d+\] ")
+SPLIT_SHARD_RE = re.compile(r"^userbouquet\.(.+)\.split(\d+)\.tv$")
+
+EPISODE_RE = re.compile(r"(.*?)\s+S(\d+)\s+E(\d+)", re.IGNORECASE)
+
+def similar_prefix(name):
+    """Return the prefix IPTVEditor.select_similar groups a channel name by.
+
+    Channels whose name starts with the prefix, or equals it without the
+    trailing space, belong to the same group.
+    """
+    if ":" in name:
+        return name.split(":")[0] + ":"
+
+    if (match := EPISODE_RE.match(name)):
+        base_prefix = match.group(1) + " "
+    elif name.startswith("24/7 "):
+        base_prefix = "24/7 "
+    else:
+        parts = name.split(" ", 2)
+        base_prefix = parts[0] + " " if len(parts) > 1 else name + " "
+        if len(parts) > 2 and parts[1] in ["Premiere", "Series", "Episode", "TV+"]:
+            base_prefix = f"{parts[0]} {parts[1]} "
+    return base_prefix
+
+def split_filename(filename, index):
+    base = filename.replace("userbouquet.", "", 1).rsplit(".tv", 1)[0]
+    return f"userbouquet.{base}.split{index:03d}.tv"
+
+def split_order_filename(filename):
+    base = filename.replace("userbouquet.", "", 1).rsplit(".tv", 1)[0]
+    return f"userbouquet.{base}.split.json"
+
+def split_shards(base, path=BOUQUET_PATH):
+    """Return the shards of the split set of userbouquet.<base>.tv in order."""
+    with os.scandir(path) as entries:
+        shards = sorted(
+            (int(m.group(2)), entry.name) for entry in entries
+            if (m := SPLIT_SHARD_RE.match(entry.name)) and m.group(1) == base
+        )
+    return [name for number, name in shards]
+
+def remove_split_orders(filenames, path=BOUQUET_PATH, order_path=SPLIT_ORDER_PATH):
+    """Drop the order sidecar of every split set whose last shard is gone.
+
+    Called after shards have been removed from path; filenames that are
+    not shards are ignored.
+    """
+    bases = set(m.group(1) for filename in filenames if (m := SPLIT_SHARD_RE.match(filename)))
+    for base in bases:
+        if not split_shards(base, path):
+            try:
+                os.remove(os.path.join(order_path, split_order_filename(f"userbouquet.{base}.tv")))
+            except FileNotFoundError:
+                pass
+
+def read_bouquet_entries(file_path):
+    """Return (bouquet name, entries) with one list of lines per #SERVICE."""
+    bouquet_name = None
+    entries = []
+    with open(file_path, "r", errors="ignore") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.startswith("#NAME"):
+                bouquet_name = line.replace("#NAME", "").strip()
+            elif line.startswith("#SERVICE") or (line.strip() and not entries):
+                entries.append([line + "\n"])
+            elif line.strip():
+                entries[-1].append(line + "\n")
+    return bouquet_name, entries
+
+def split_bouquet(filename, max_entries=SPLIT_MAX_ENTRIES, path=BOUQUET_PATH, order_path=SPLIT_ORDER_PATH):
+    """Shard a bouquet into sub-bouquets grouped like select_similar.
+
+    The bouquet is read in one pass and every channel is filed under its
+    similar_prefix group. With max_entries=None each group becomes its own
+    bouquet, otherwise consecutive groups are packed into bouquets of at
+    most max_entries channels (a larger group still stays whole). The
+    shards replace the original in bouquets.tv in one atomic rewrite and
+    the original file is removed. The original name and the original
+    position of every entry are kept in a sidecar file in order_path for
+    merge_bouquet. Returns the new filenames.
+    """
+    bouquet_name, entries = read_bouquet_entries(os.path.join(path, filename))
+    bouquet_name = bouquet_name or filename
+    groups = {}
+
+    for position, entry in enumerate(entries):
+        if len(entry) > 1 and entry[1].startswith("#DESCRIPTION"):
+            label = similar_prefix(entry[1].replace("#DESCRIPTION", "").strip()).rstrip()
+        else:
+            label = "Other"
+        groups.setdefault(label, []).append((position, entry))
+
+    if not groups:
+        raise ValueError(f"No channels found in {filename}")
+
+    chunks = []
+    for label, entries in groups.items():
+        if chunks and max_entries and chunks[-1][1] + len(entries) <= max_entries:
+            chunks[-1][0].append(label)
+            chunks[-1][1] += len(entries)
+            chunks[-1][2].extend(entries)
+        else:
+            chunks.append([[label], len(entries), list(entries)])
+
+    shard_files = []
+    order = {"name": bouquet_name, "positions": {}}
+    with bouquet_write_lock:
+        for index, (labels, count, entries) in enumerate(chunks):
+            label = labels[0] if len(labels) == 1 else f"{labels[0]} .. {labels[-1]}"
+            shard = split_filename(filename, index + 1)
+            lines = [f"#NAME {bouquet_name} [{index + 1}/{len(chunks)}] {label}\n"]
+            for position, entry in entries:
+                lines.extend(entry)
+            replace_file(os.path.join(path, shard), lines)
+            shard_files.append(shard)
+            order["positions"][shard] = [position for position, entry in entries]
+
+        os.makedirs(order_path, exist_ok=True)
+        replace_file(os.path.join(order_path, split_order_filename(filename)), [json.dumps(order)])
+        rewrite_bouquets_tv({filename: shard_files}, path)
+        os.remove(os.path.join(path, filename))
+    return shard_files
+
+def merge_bouquet(shard, path=BOUQUET_PATH, order_path=SPLIT_ORDER_PATH):
+    """Reverse split_bouquet for the split set that shard belongs to.
+
+    The entries of all shards are put back in their original order from
+    the split sidecar file (shards without a usable one are concatenated)
+    and written to the original bouquet, which takes the place of the
+    first shard in bouquets.tv. Refuses to overwrite an existing bouquet
+    of the original name. Returns the filename of the merged bouquet.
+    """
+    match = SPLIT_SHARD_RE.match(shard)
+    if not match:
+        raise ValueError(f"{shard} is not a split bouquet")
+    base = match.group(1)
+    shards = split_shards(base, path)
+    if not shards:
+        raise ValueError(f"No shards of {shard} found")
+
+    filename = f"userbouquet.{base}.tv"
+    if os.path.exists(os.path.join(path, filename)):
+        raise ValueError(f"{filename} already exists, delete or rename it before merging")
+    order_file = os.path.join(order_path, split_order_filename(filename))
+    try:
+        with open(order_file, "r") as f:
+            order = json.load(f)
+    except (IOError, OSError, ValueError):
+        order = {"positions": {}}
+
+    bouquet_name = order.get("name")
+    positioned = []
+    for name in shards:
+        shard_name, entries = read_bouquet_entries(os.path.join(path, name))
+        if bouquet_name is None and shard_name is not None:
+            match = SPLIT_NAME_RE.match(shard_name + " ")
+            bouquet_name = match.group(1) if match else shard_name
+        # A shard edited since the split keeps its own order after the rest
+        positions = order["positions"].get(name, [])
+        if len(positions) != len(entries):
+            positions = [float("inf")] * len(entries)
+        positioned.extend(zip(positions, entries))
+    positioned.sort(key=itemgetter(0))
+    bouquet_name = bouquet_name or base
+    lines = [line for position, entry in positioned for line in entry]
+
+    with bouquet_write_lock:
+        replace_file(os.path.join(path, filename), [f"#NAME {bouquet_name}\n"] + lines)
+        replacements = dict((name, []) for name in shards)
+        replacements[shards[0]] = [filename]
+        rewrite_bouquets_tv(replacements, path)
+        for name in shards:
+            os.remove(os.path.join(path, name))
+        if os.path.exists(order_file):
+            os.remove(order_file)
+    return filename
+
+INDEX_VERSION = 2
+SEARCH_LIMIT = 200
+# A single character matches a large share of all channels, so ranking
+# it would not keep up with typing
+SEARCH_MIN_LENGTH = 2
+
+def is_iptv_bouquet(filename):
+    return (filename.startswith("userbouquet.ciefpsettings") or
+            filename.startswith("userbouquet.iptv") or
+            "iptv" in filename.lower()) and filename.endswith(".tv")
+
+def encode_postings(rows):
+    """Pack ascending row numbers as gaps, which compress to a few bits."""
+    return array("I", [row - previous for previous, row in zip([0] + rows, rows)]).tobytes()
+
+def decode_postings(data):
+    gaps = array("I")
+    gaps.frombytes(data)
+    return accumulate(gaps)
+
+class ChannelIndex(object):
+    """Persistent trigram index over IPTV channel names.
+
+    Every indexed bouquet keeps its channel names in IPTVEditor row order
+    and one delta-encoded posting list per trigram of the space-padded,
+    lower-cased names. The padding makes " ab" double as the two-character
+    word-prefix index. Bouquets are only re-read when their mtime or size
+    changes, and the whole index is stored as a compressed pickle in
+    DATA_PATH, away from the settings directory.
+    """
+
+    def __init__(self, index_path=INDEX_PATH):
+        self.index_path = index_path
+        self.files = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.files = {}
+        try:
+            with open(self.index_path, "rb") as f:
+                data = pickle.loads(zlib.decompress(f.read()))
+            if data.get("version") == INDEX_VERSION:
+                self.files = data["files"]
+        except Exception:
+            pass
+        self.loaded = True
+
+    def save(self):
+        data = {"version": INDEX_VERSION, "files": self.files}
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), 1))
+        os.replace(tmp_path, self.index_path)
+
+    def update(self, path=BOUQUET_PATH, job=None):
+        """Bring the index in line with the bouquets on disk.
+
+        Returns the number of bouquets that were (re)indexed or dropped.
+        """
+        # Screens may start an update while a cancelled one still runs
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+            seen = set()
+            changed = 0
+            with os.scandir(path) as entries:
+                bouquets = [entry for entry in entries if is_iptv_bouquet(entry.name) and entry.is_file()]
+            for entry in bouquets:
+                if job:
+                    job.check_cancelled()
+                seen.add(entry.name)
+                stat = entry.stat()
+                indexed = self.files.get(entry.name)
+                if indexed and indexed["mtime"] == stat.st_mtime_ns and indexed["size"] == stat.st_size:
+                    continue
+                if job:
+                    job.progress(f"Indexing {entry.name}...")
+                self.files[entry.name] = self.index_file(entry.path, stat)
+                changed += 1
+
+            for filename in list(self.files):
+                if filename not in seen:
+                    del self.files[filename]
+                    changed += 1
+
+            if changed:
+                self.save()
+            return changed
+
+    def index_file(self, file_path, stat):
+        bouquet_name = os.path.basename(file_path)
+        names = []
+        with open(file_path, "r", errors="ignore") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("#NAME"):
+                    bouquet_name = line.replace("#NAME", "").strip()
+                elif line.startswith("#SERVICE"):
+                    names.append(line)
+                elif line.startswith("#DESCRIPTION") and names:
+                    names[-1] = line.replace("#DESCRIPTION", "").strip()
+
+        grams = {}
+        for row, name in enumerate(names):
+            text = " " + name.lower() + " "
+            for gram in set(text[i:i + 3] for i in range(len(text) - 2)):
+                grams.setdefault(gram, []).append(row)
+
+        return {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "name": bouquet_name,
+            "names": names,
+            "grams": dict((gram, encode_postings(rows)) for gram, rows in grams.items()),
+        }
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Return up to limit (filename, row, channel name, bouquet name)
+        tuples for channels whose name contains query, best matches first.
+        """
+        query = " ".join(query.lower().split())
+        if len(query) < SEARCH_MIN_LENGTH:
+            return []
+
+        def ranked():
+            for filename, indexed in self.files.items():
+                if len(query) < 3:
+                    # Two characters only match at the start of a word
+                    grams = [" " + query]
+                else:
+                    grams = [query[i:i + 3] for i in range(len(query) - 2)]
+                postings = [indexed["grams"].get(gram) for gram in grams]
+                if not all(postings):
+                    continue
+                postings.sort(key=len)
+                rows = set(decode_postings(postings[0]))
+                for posting in postings[1:]:
+                    rows.intersection_update(decode_postings(posting))
+                names = indexed["names"]
+                for row in rows:
+                    name = names[row]
+                    lower = name.lower()
+                    if lower == query:
+                        rank = 0
+                    elif lower.startswith(query):
+                        rank = 1
+                    elif (" " + query) in lower:
+                        rank = 2
+                    elif query in lower:
+                        rank = 3
+                    else:
+                        continue
+                    yield (rank, len(name), name, filename, row, indexed["name"])
+
+        return [
+            (filename, row, name, bouquet_name)
+            for rank, length, name, filename, row, bouquet_name in heapq.nsmallest(limit, ranked())
+        ]
+
+channel_index = ChannelIndex()
+
+def picon_name(service):
+    """Return the picon filename enigma2 looks up for a #SERVICE line.
+
+    Stream services are mapped to their 1_0_1_... form like the Picon
+    renderer does. Markers, sub-bouquets and references without a service
+    id return None.
+    """
+    ref = service.replace("#SERVICE", "", 1).strip()
+    if "FROM BOUQUET" in ref:
+        return None
+    fields = ref.split(":")
+    if len(fields) < 10 or fields[1] == "64" or all(field == "0" for field in fields[3:7]):
+        return None
+    fields = fields[:10]
+    fields[0] = "1"
+    if fields[2] != "2":
+        fields[2] = "1"
+    return "_".join(fields).upper() + ".png"
+
+class PiconCache(object):
+    """Size-capped LRU cache of picons fetched by the plugin.
+
+    Only picons the plugin downloaded itself are tracked in the manifest
+    and evicted, least recently used first, once their total size goes
+    over max_bytes. Picons installed by other means are never touched.
+    Names the server does not have are remembered as misses and only
+    asked for again after miss_ttl seconds.
+    """
+
+    MANIFEST = ".ciefpiptv_picons.json"
+
+    def __init__(self, path=PICON_PATH, max_bytes=PICON_CACHE_MAX_BYTES, base_url=PICON_BASE_URL,
+                 workers=PICON_WORKERS, miss_ttl=PICON_MISS_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.base_url = base_url
+        self.workers = workers
+        self.miss_ttl = miss_ttl
+        self.manifest_path = os.path.join(path, self.MANIFEST)
+        self.entries = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.entries = {}
+        self.misses = {}
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        for name, (size, last_used) in manifest.get("picons", {}).items():
+            if os.path.exists(os.path.join(self.path, name)):
+                self.entries[name] = [size, last_used]
+        self.misses = manifest.get("misses", {})
+
+    def save(self):
+        now = time.time()
+        misses = dict((name, checked) for name, checked in self.misses.items() if now - checked < self.miss_ttl)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"picons": self.entries, "misses": misses}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def fetch(self, name):
+        response = requests.get(self.base_url + name, timeout=10)
+        if response.status_code != 200 or not response.content:
+            return None
+        return response.content
+
+    def prefetch(self, services, job=None):
+        """Fetch the missing picons for services.
+
+        Each picon name is resolved once per call, whatever the number of
+        services sharing it. Recent misses are counted as failed without a
+        request. Returns (fetched, present, failed) counts.
+        """
+        # Concurrent installs share the manifest, so they take turns
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            self.load()
+            now = time.time()
+
+            names = []
+            seen = set()
+            present = 0
+            failed = 0
+            for service in services:
+                name = picon_name(service)
+                if not name or name in seen:
+                    continue
+                seen.add(name)
+                if os.path.exists(os.path.join(self.path, name)):
+                    present += 1
+                    if name in self.entries:
+                        self.entries[name][1] = now
+                elif now - self.misses.get(name, 0) < self.miss_ttl:
+                    failed += 1
+                else:
+                    names.append(name)
+
+            fetched = 0
+            try:
+                if names:
+                    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                        futures = dict((executor.submit(self.fetch, name), name) for name in names)
+                        for future in as_completed(futures):
+                            name = futures[future]
+                            if job and job.cancelled:
+                                for pending in futures:
+                                    pending.cancel()
+                                job.check_cancelled()
+                            try:
+                                content = future.result()
+                                if content is None:
+                                    self.misses[name] = now
+                            except Exception:
+                                # Network errors are not remembered, the next run retries
+                                content = None
+                            if content is None:
+                                failed += 1
+                            else:
+                                replace_file_bytes(os.path.join(self.path, name), content)
+                                self.entries[name] = [len(content), now]
+                                self.misses.pop(name, None)
+                                fetched += 1
+                            if job:
+                                job.progress(f"Fetching picons... ({fetched + failed}/{len(seen) - present})")
+            finally:
+                # Picons already written must be tracked even when cancelled
+                self.evict()
+                self.save()
+            return fetched, present, failed
+
+    def evict(self):
+        total = sum(size for size, last_used in self.entries.values())
+        for name in sorted(self.entries, key=lambda n: self.entries[n][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= self.entries.pop(name)[0]
+
+picon_cache = PiconCache()
+
+def bouquet_display_name(path, filename):
+    display_name = filename
+    try:
+        with open(os.path.join(path, filename), "r") as file:
+            for line in file:
+                if line.startswith("#NAME"):
+                    display_name = line.replace("#NAME", "").strip()
+                    break
+    except:
+        display_name = filename.replace("userbouquet.", "").replace(".tv", "")
+    return display_name
+
+def list_iptv_bouquets(path=BOUQUET_PATH):
+    """Return (filename, display name) for every IPTV bouquet on disk.
+
+    Bouquets listed in bouquets.tv come first, in that order, followed by
+    the ones it does not reference.
+    """
+    bouquets_order = []
+    bouquets_tv_path = os.path.join(path, "bouquets.tv")
+    if os.path.exists(bouquets_tv_path):
+        with open(bouquets_tv_path, "r") as f:
+            for line in f:
+                filename = bouquet_reference(line)
+                if filename:
+                    bouquets_order.append(filename)
+
+    all_files = {}
+    for f in os.listdir(path):
+        if is_iptv_bouquet(f):
+            all_files[f] = bouquet_display_name(path, f)
+
+    ordered_files = []
+    for filename in bouquets_order:
+        if filename in all_files:
+            ordered_files.append((filename, all_files.pop(filename)))
+
+    for filename, display_name in all_files.items():
+        ordered_files.append((filename, display_name))
+    return ordered_files
+
+class HttpCatalogSource(object):
+    """Catalog served over HTTP: the GitHub contents API, or any web server
+    listing the directory as GitHub-style JSON or as an HTML index."""
+
+    def __init__(self, location):
+        self.location = location if location.endswith("/") else location + "/"
+        self.name = self.location.split("//", 1)[-1].split("/", 1)[0]
+        self.urls = {}
+
+    def list(self):
+        response = requests.get(self.location, timeout=CATALOG_TIMEOUT)
+        response.raise_for_status()
+        try:
+            files = response.json()
+            if not isinstance(files, list):
+                raise IOError(str(files.get("message", files)) if isinstance(files, dict) else "Unexpected listing")
+        except ValueError:
+            files = [
+                {"name": unquote(href.rsplit("/", 1)[-1]), "download_url": urljoin(self.location, href)}
+                for href in re.findall(r'href="([^"?#]+\.tv)"', response.text)
+            ]
+        listing = []
+        for file in files:
+            if isinstance(file, dict) and file.get("name", "").endswith(".tv"):
+                self.urls[file["name"]] = file.get("download_url") or urljoin(self.location, quote(file["name"]))
+                listing.append(file["name"])
+        return listing
+
+    def fetch(self, filename):
+        url = self.urls.get(filename) or urljoin(self.location, quote(filename))
+        response = requests.get(url, timeout=CATALOG_TIMEOUT)
+        response.raise_for_status()
+        return response.text
+
+class LocalCatalogSource(object):
+    def __init__(self, location):
+        self.location = location.replace("file://", "", 1)
+        self.name = self.location
+
+    def list(self):
+        return sorted(f for f in os.listdir(self.location) if f.endswith(".tv"))
+
+    def fetch(self, filename):
+        with open(os.path.join(self.location, filename), "r") as f:
+            return f.read()
+
+def catalog_source(location):
+    if location.startswith("/") or location.startswith("file://"):
+        return LocalCatalogSource(location)
+    return HttpCatalogSource(location)
+
+def load_catalog_sources(path=CATALOG_SOURCES_PATH):
+    try:
+        with open(path, "r") as f:
+            locations = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    except (IOError, OSError):
+        locations = []
+    return locations or list(CATALOG_SOURCES)
+
+class CatalogMirrors(object):
+    """Picks the fastest catalog source and fails over between sources.
+
+    select() lists every source at once and returns as soon as the first
+    one answers. The others keep running and are ranked by latency as they
+    finish, giving the failover order for fetch(). The choice is reused
+    for ttl seconds.
+    """
+
+    def __init__(self, locations=None, ttl=CATALOG_SOURCE_TTL):
+        self.sources = [catalog_source(location) for location in (locations or load_catalog_sources())]
+        self.ttl = ttl
+        self.ranked = []
+        self.selected_at = None
+        self.lock = threading.Lock()
+
+    def select(self):
+        """Return (source, listing) for the fastest healthy source."""
+        with self.lock:
+            fresh = self.ranked and time.monotonic() - self.selected_at < self.ttl
+            source = self.ranked[0] if fresh else None
+        if source is not None:
+            try:
+                return source, source.list()
+            except Exception:
+                self.demote(source)
+        return self.race()
+
+    def race(self):
+        winner = queue.Queue()
+        ranked = []
+        started = time.monotonic()
+
+        def timed_list(source):
+            listing = source.list()
+            if not listing:
+                raise IOError("No bouquets listed")
+            return time.monotonic() - started, listing
+
+        def finished(future, source):
+            try:
+                latency, listing = future.result()
+            except Exception as e:
+                winner.put((source, None, e))
+                return
+            with self.lock:
+                ranked.append((latency, source))
+                ranked.sort(key=itemgetter(0))
+                self.ranked = [ranked_source for latency, ranked_source in ranked]
+            winner.put((source, listing, None))
+
+        with self.lock:
+            self.ranked = []
+            self.selected_at = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=len(self.sources))
+        for source in self.sources:
+            future = executor.submit(timed_list, source)
+            future.add_done_callback(lambda future, source=source: finished(future, source))
+        executor.shutdown(wait=False)
+
+        errors = []
+        for i in range(len(self.sources)):
+            source, listing, error = winner.get()
+            if error is None:
+                return source, listing
+            errors.append(f"{source.name}: {str(error)}")
+        raise IOError("No catalog source available (" + "; ".join(errors) + ")")
+
+    def demote(self, source):
+        with self.lock:
+            if source in self.ranked:
+                self.ranked.remove(source)
+                self.ranked.append(source)
+
+    def fetch(self, filename):
+        return self.download(filename)[1]
+
+    def download(self, filename):
+        """Return (source, content) for a catalog file, moving on to the
+        next source when one fails or stalls for longer than CATALOG_TIMEOUT."""
+        with self.lock:
+            order = list(self.ranked)
+        order += [source for source in self.sources if source not in order]
+
+        errors = []
+        for source in order:
+            try:
+                return source, source.fetch(filename)
+            except Exception as e:
+                errors.append(f"{source.name}: {str(e)}")
+                self.demote(source)
+        raise IOError(f"Could not download {filename} (" + "; ".join(errors) + ")")
+
+catalog_mirrors = CatalogMirrors()
+
+def fetch_catalog(job=None, mirrors=None):
+    """List the bouquets offered by the fastest catalog source.
+
+    Returns (bouquet_files, bouquet_list) where bouquet_files maps each
+    display name to its filename and the name of the source that served it.
+    """
+    mirrors = mirrors or catalog_mirrors
+    source, files = mirrors.select()
+
+    bouquet_files = {}
+    bouquet_list = []
+
+    for index, filename in enumerate(files):
+        if job:
+            job.check_cancelled()
+            job.progress(f"Fetching bouquets from {source.name}... ({index + 1}/{len(files)})")
+
+        served_by, file_content = mirrors.download(filename)
+        file_content = file_content.splitlines()
+        display_name = filename.replace("userbouquet.", "").replace(".tv", "")
+
+        for line in file_content:
+            if line.startswith("#NAME"):
+                display_name = line.replace("#NAME", "").strip()
+                break
+
+        bouquet_files[display_name] = {
+            "filename": filename,
+            "source": served_by.name
+        }
+        bouquet_list.append(display_name)
+
+    return bouquet_files, bouquet_list
+
+def fetch_bouquet_channels(filename, mirrors=None):
+    content = (mirrors or catalog_mirrors).fetch(filename).splitlines()
+    channels = []
+    for line in content:
+        if line.startswith("#DESCRIPTION"):
+            channels.append(line.replace("#DESCRIPTION", "").strip())
+    return channels
+
+def install_bouquets(bouquets, job=None, path=BOUQUET_PATH, picons=True, mirrors=None):
+    """Download catalog bouquets and register them in bouquets.tv.
+
+    bouquets is a list of catalog entries as returned by fetch_catalog.
+    All bouquets are downloaded and validated first, then written and
+    registered with a single bouquets.tv rewrite. Returns a dict with the
+    installed filenames, the source that served each of them, the picon
+    counts and the time spent per stage.
+    """
+    timings = {}
+    started = time.monotonic()
+    downloads = []
+    sources = {}
+    for index, bouquet_info in enumerate(bouquets):
+        filename = bouquet_info["filename"]
+        if job:
+            job.check_cancelled()
+            job.progress(f"Installing bouquets... ({index + 1}/{len(bouquets)}) {filename}")
+
+        source, content = (mirrors or catalog_mirrors).download(filename)
+        if not content.startswith("#NAME"):
+            raise ValueError(f"Invalid bouquet file format: {filename}")
+        downloads.append((filename, content))
+        sources[filename] = source.name
+    timings["download"] = time.monotonic() - started
+
+    started = time.monotonic()
+    with bouquet_write_lock:
+        for filename, content in downloads:
+            replace_file(os.path.join(path, filename), [content])
+        rewrite_bouquets_tv(dict((filename, [filename]) for filename, content in downloads), path)
+    timings["write"] = time.monotonic() - started
+
+    result = {
+        "installed": [filename for filename, content in downloads],
+        "sources": sources,
+        "timings": timings,
+    }
+    if picons:
+        started = time.monotonic()
+        try:
+            result["picons"] = install_picons(result["installed"], job, path)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            result["picon_error"] = str(e)
+        timings["picons"] = time.monotonic() - started
+    return result
+
+def install_picons(filenames, job=None, path=BOUQUET_PATH):
+    """Fetch the missing picons for the channels of installed bouquets.
+
+    Kept apart from install_bouquets so the screens can offer the service
+    list reload first and run this as its own job. Returns the
+    (fetched, present, failed) counts of PiconCache.prefetch.
+    """
+    services = []
+    for filename in filenames:
+        with open(os.path.join(path, filename), "r", errors="ignore") as f:
+            services.extend(line for line in f if line.startswith("#SERVICE"))
+    if job:
+        job.progress("Fetching picons...")
+    return picon_cache.prefetch(services, job)
+
+def delete_bouquets(filenames, job=None, path=BOUQUET_PATH):
+    """Remove bouquet files and drop them from bouquets.tv in one rewrite.
+
+    bouquets.tv is rewritten before any file is removed, and once it has
+    been the job is no longer cancellable, so bouquets.tv never points at
+    a deleted file.
+    """
+    if job:
+        job.check_cancelled()
+    with bouquet_write_lock:
+        rewrite_bouquets_tv(dict((filename, []) for filename in filenames), path)
+        for index, filename in enumerate(filenames):
+            if job:
+                job.progress(f"Deleting bouquets... ({index + 1}/{len(filenames)})")
+            try:
+                os.remove(os.path.join(path, filename))
+            except FileNotFoundError:
+                pass
+        remove_split_orders(filenames, path)
+    return len(filenames)
+
+def read_bouquet(bouquet_path):
+    """Parse a bouquet into its name and a list of channel dicts."""
+    bouquet_name = ""
+    channels = []
+    with open(bouquet_path, "r") as file:
+        current_channel = None
+        for line in file:
+            line = line.strip()
+            if line.startswith("#NAME"):
+                bouquet_name = line.replace("#NAME", "").strip()
+            elif line.startswith("#SERVICE"):
+                if current_channel:
+                    channels.append(current_channel)
+                current_channel = {"service": line, "description": ""}
+            elif line.startswith("#DESCRIPTION") and current_channel:
+                current_channel["description"] = line.replace("#DESCRIPTION", "").strip()
+
+        if current_channel:
+            channels.append(current_channel)
+    return bouquet_name, channels
+
+def write_bouquet(bouquet_path, bouquet_name, channels):
+    with bouquet_write_lock:
+        with open(bouquet_path, "w") as file:
+            file.write(f"#NAME {bouquet_name}\n")
+            for channel in channels:
+                file.write(f"{channel['service']}\n")
+                if channel["description"]:
+                    file.write(f"#DESCRIPTION {channel['description']}\n")
+    return channels
+
+def reload_service_lists(url=WEBIF_RELOAD_URL):
+    """Ask a running enigma2 to reload lamedb and bouquets through the web
+    interface, for callers outside the enigma2 process."""
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+
+def file_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_snapshot_manifest(archive_path):
+    with zipfile.ZipFile(archive_path) as archive:
+        return json.loads(archive.read("manifest.json").decode("utf-8"))
+
+def list_snapshots(snapshot_path=SNAPSHOT_PATH):
+    """Return (archive name, manifest) for every snapshot, newest first."""
+    if not os.path.isdir(snapshot_path):
+        return []
+    snapshots = []
+    for name in os.listdir(snapshot_path):
+        if name.startswith("snapshot-") and name.endswith(".zip"):
+            try:
+                snapshots.append((name, read_snapshot_manifest(os.path.join(snapshot_path, name))))
+            except (IOError, OSError, ValueError, KeyError, zipfile.BadZipFile):
+                continue
+    snapshots.sort(key=lambda snapshot: snapshot[1]["created"], reverse=True)
+    return snapshots
+
+def create_snapshot(job=None, path=BOUQUET_PATH, snapshot_path=SNAPSHOT_PATH):
+    """Store every IPTV bouquet and bouquets.tv in a new snapshot archive.
+
+    Files are addressed by their SHA-1. A blob already stored by an
+    earlier snapshot is only referenced, so each archive holds just the
+    files that changed since and depends on the archives it references;
+    use prune_snapshots to remove old ones. Returns (archive name, files,
+    blobs stored).
+    """
+    os.makedirs(snapshot_path, exist_ok=True)
+    known = {}
+    for name, manifest in list_snapshots(snapshot_path):
+        known.update(manifest["blobs"])
+
+    filenames = [filename for filename, display_name in list_iptv_bouquets(path)]
+    if os.path.exists(os.path.join(path, "bouquets.tv")):
+        filenames.append("bouquets.tv")
+
+    archive_name = time.strftime("snapshot-%Y%m%d-%H%M%S.zip")
+    counter = 1
+    while os.path.exists(os.path.join(snapshot_path, archive_name)):
+        counter += 1
+        archive_name = time.strftime(f"snapshot-%Y%m%d-%H%M%S-{counter}.zip")
+    archive_path = os.path.join(snapshot_path, archive_name)
+    manifest = {"created": time.time(), "files": {}, "blobs": {}}
+    stored = 0
+    try:
+        with bouquet_write_lock:
+            with zipfile.ZipFile(archive_path + ".tmp", "w", zipfile.ZIP_DEFLATED) as archive:
+                for index, filename in enumerate(filenames):
+                    if job:
+                        job.check_cancelled()
+                        job.progress(f"Creating snapshot... ({index + 1}/{len(filenames)})")
+                    file_path = os.path.join(path, filename)
+                    digest = file_hash(file_path)
+                    manifest["files"][filename] = digest
+                    if digest in known:
+                        manifest["blobs"][digest] = known[digest]
+                    elif digest not in manifest["blobs"]:
+                        archive.write(file_path, "blobs/" + digest)
+                        manifest["blobs"][digest] = archive_name
+                        stored += 1
+                archive.writestr("manifest.json", json.dumps(manifest))
+    except BaseException:
+        if os.path.exists(archive_path + ".tmp"):
+            os.remove(archive_path + ".tmp")
+        raise
+    os.replace(archive_path + ".tmp", archive_path)
+    return archive_name, len(filenames), stored
+
+def restore_snapshot(archive_name, job=None, path=BOUQUET_PATH, snapshot_path=SNAPSHOT_PATH):
+    """Put the bouquets of a snapshot back in place.
+
+    Every file is streamed from its archive into a temporary file next to
+    its target and renamed over it, bouquets.tv last. IPTV bouquets that
+    did not exist when the snapshot was taken are removed. The caller
+    reloads the service lists once afterwards. Returns the number of files
+    restored.
+    """
+    manifest = read_snapshot_manifest(os.path.join(snapshot_path, archive_name))
+    files = sorted(manifest["files"].items(), key=lambda item: item[0] == "bouquets.tv")
+
+    if job:
+        job.check_cancelled()
+
+    archives = {}
+    try:
+        # Unchanged blobs live in older archives. Open all of them and check
+        # every blob up front, so a missing archive fails before any file
+        # has been replaced
+        for filename, digest in files:
+            blob_archive = manifest["blobs"][digest]
+            if blob_archive not in archives:
+                blob_path = os.path.join(snapshot_path, blob_archive)
+                if not os.path.exists(blob_path):
+                    raise IOError(f"{archive_name} needs {blob_archive}, which has been deleted")
+                archives[blob_archive] = zipfile.ZipFile(blob_path)
+            if "blobs/" + digest not in archives[blob_archive].namelist():
+                raise IOError(f"{blob_archive} does not contain {filename} for {archive_name}")
+
+        if job:
+            job.check_cancelled()
+
+        # Once files start being replaced the restore runs to the end, so a
+        # closed screen never leaves a half-restored bouquet store behind
+        with bouquet_write_lock:
+            for index, (filename, digest) in enumerate(files):
+                if job:
+                    job.progress(f"Restoring snapshot... ({index + 1}/{len(files)})")
+                blob_archive = manifest["blobs"][digest]
+                target = os.path.join(path, filename)
+                with archives[blob_archive].open("blobs/" + digest) as source:
+                    with open(target + ".tmp", "wb") as f:
+                        shutil.copyfileobj(source, f, 65536)
+                os.replace(target + ".tmp", target)
+
+            for filename, display_name in list_iptv_bouquets(path):
+                if filename not in manifest["files"]:
+                    os.remove(os.path.join(path, filename))
+    finally:
+        for archive in archives.values():
+            archive.close()
+    return len(files)
+
+def prune_snapshots(keep, snapshot_path=SNAPSHOT_PATH):
+    """Delete all but the newest keep snapshots.
+
+    Snapshot archives must not be deleted by hand: an archive also holds
+    the blobs that later snapshots only reference. An older archive that a
+    kept snapshot still needs is left in place. Returns the deleted names.
+    """
+    snapshots = list_snapshots(snapshot_path)
+    needed = set()
+    for name, manifest in snapshots[:keep]:
+        needed.add(name)
+        needed.update(manifest["blobs"].values())
+    deleted = []
+    for name, manifest in snapshots[keep:]:
+        if name not in needed:
+            os.remove(os.path.join(snapshot_path, name))
+            deleted.append(name)
+    return deleted
+
+SORT_MODES = [
+    ("name", "Sort by name"),
+    ("episode", "Sort by episode"),
+    ("group", "Sort by group"),
+    ("host", "Sort by stream host"),
+]
+DIGITS_RE = re.compile(r"\d+")
+
+@lru_cache(maxsize=16384)
+def natural_key(text):
+    """Zero-pad embedded numbers so they compare numerically ("E2" < "E10").
+
+    A plain string key sorts several times faster than a tuple of parts,
+    and the cache pays off for series titles shared by many episodes.
+    """
+    return DIGITS_RE.sub(lambda match: match.group().zfill(12), text.casefold())
+
+def stream_host(service):
+    fields = service.split(":", 10)
+    if len(fields) < 11:
+        return ""
+    # The URL runs on into the channel name and may hold raw colons of its
+    # own, so only the authority after "//" is looked at
+    url = fields[10].lower()
+    start = url.find("//")
+    if start < 0:
+        return ""
+    host = url[start + 2:]
+    for separator in ("/", "?"):
+        end = host.find(separator)
+        if end >= 0:
+            host = host[:end]
+    # Credentials may contain colons, escaped or not, so drop them first
+    host = host[host.rfind("@") + 1:]
+    for separator in ("%3a", ":"):
+        end = host.find(separator)
+        if end >= 0:
+            host = host[:end]
+    return host
+
+def channel_sort_key(channel, mode):
+    name = channel["description"] or channel["service"]
+    if mode == "name":
+        return natural_key(name)
+    if mode == "episode":
+        match = EPISODE_RE.match(name)
+        if match:
+            return (natural_key(match.group(1)), int(match.group(2)), int(match.group(3)))
+        return (natural_key(name), -1, -1)
+    if mode == "group":
+        return similar_prefix(name).casefold()
+    if mode == "host":
+        return stream_host(channel["service"])
+    raise ValueError(f"Unknown sort mode: {mode}")
+
+def sort_channels(channels, mode, cache=None):
+    """Return channels stably sorted by one of the SORT_MODES.
+
+    Keys are computed once per channel and mode and kept in cache, a dict
+    the caller holds on to between sorts of the same channel dicts.
+    """
+    if cache is None:
+        cache = {}
+    keys = cache.setdefault(mode, {})
+    get = keys.get
+
+    pairs = []
+    for channel in channels:
+        cached = get(id(channel))
+        if cached is None or cached[0] is not channel:
+            cached = keys[id(channel)] = (channel, channel_sort_key(channel, mode))
+        pairs.append(cached)
+    pairs.sort(key=itemgetter(1))
+    return [pair[0] for pair in pairs]
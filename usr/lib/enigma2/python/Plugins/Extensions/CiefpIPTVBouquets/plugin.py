@@ -1,21 +1,23 @@
 import os
-import requests
+import time
 from Components.Pixmap import Pixmap
-from Components.ActionMap import ActionMap
+from Components.ActionMap import ActionMap, NumberActionMap
 from Components.Label import Label
 from Components.MenuList import MenuList
 from Components.FileList import FileList
+from Components.Input import Input
 from Plugins.Plugin import PluginDescriptor
 from Screens.Screen import Screen
 from Screens.MessageBox import MessageBox
-from enigma import eDVBDB
-import re
-
-PLUGIN_VERSION = "1.7" 
-PLUGIN_NAME = "CiefpIPTVBouquets"
-PLUGIN_DESCRIPTION = "Enigma2 IPTV Bouquets"
-GITHUB_API_URL = "https://api.github.com/repos/ciefp/CiefpIPTV/contents/"
-BOUQUET_PATH = "/etc/enigma2/"
+from Screens.ChoiceBox import ChoiceBox
+from enigma import eDVBDB, eRCInput, getPrevAsciiCode
+from .core import (
+    BOUQUET_PATH, PLUGIN_DESCRIPTION, PLUGIN_NAME, PLUGIN_VERSION, SEARCH_MIN_LENGTH, SORT_MODES,
+    apply_bouquet_garbage, bouquet_display_name, channel_index, create_snapshot, delete_bouquets,
+    fetch_bouquet_channels, fetch_catalog, garbage_report, install_bouquets, install_picons, job_queue,
+    list_iptv_bouquets, list_snapshots, merge_bouquet, read_bouquet, restore_snapshot,
+    scan_bouquet_garbage, similar_prefix, sort_channels, split_bouquet, write_bouquet
+)
 
 class CiefpIPTV(Screen):
     skin = """
@@ -60,45 +62,33 @@ class CiefpIPTV(Screen):
         }, -1)
         
         self.onLayoutFinish.append(self.load_bouquets)
+        self.onClose.append(self.cancel_jobs)
+
+    def cancel_jobs(self):
+        job_queue.cancel_owner(self)
 
     def load_bouquets(self):
-        self["status"].setText("Fetching bouquets from GitHub...")
-        try:
-            response = requests.get(GITHUB_API_URL)
-            response.raise_for_status()
-            files = response.json()
-            
-            self.bouquet_files.clear()
-            bouquet_list = []
-            
-            for file in files:
-                if isinstance(file, dict) and file.get("name", "").endswith(".tv"):
-                    filename = file["name"]
-                    download_url = file["download_url"]
-                    
-                    file_response = requests.get(download_url)
-                    file_content = file_response.text.splitlines()
-                    display_name = filename.replace("userbouquet.", "").replace(".tv", "")
-                    
-                    for line in file_content:
-                        if line.startswith("#NAME"):
-                            display_name = line.replace("#NAME", "").strip()
-                            break
-                    
-                    self.bouquet_files[display_name] = {
-                        "filename": filename,
-                        "download_url": download_url
-                    }
-                    bouquet_list.append(display_name)
-            
-            if not bouquet_list:
-                self["status"].setText("No bouquet files found!")
-                return
-                
-            self["left_list"].setList(bouquet_list)
-            self["status"].setText("Bouquets loaded successfully")
-        except Exception as e:
-            self["status"].setText(f"Error loading bouquets: {str(e)}")
+        self["status"].setText("Fetching bouquets...")
+        job_queue.submit(
+            self, fetch_catalog,
+            on_done=self.bouquets_loaded,
+            on_error=self.bouquets_failed,
+            on_progress=self["status"].setText
+        )
+
+    def bouquets_loaded(self, result):
+        bouquet_files, bouquet_list = result
+        self.bouquet_files = bouquet_files
+
+        if not bouquet_list:
+            self["status"].setText("No bouquet files found!")
+            return
+
+        self["left_list"].setList(bouquet_list)
+        self["status"].setText("Bouquets loaded successfully")
+
+    def bouquets_failed(self, e):
+        self["status"].setText(f"Error loading bouquets: {str(e)}")
 
     def select_item(self):
         selected = self["left_list"].getCurrent()
@@ -124,54 +114,46 @@ class CiefpIPTV(Screen):
     def install_confirmed(self, result):
         if not result:
             return
-            
+
         self["status"].setText("Installing bouquets...")
-        try:
-            bouquets_tv_path = os.path.join(BOUQUET_PATH, "bouquets.tv")
-            
-            for bouquet in self.selected_bouquets:
-                bouquet_info = self.bouquet_files.get(bouquet)
-                if not bouquet_info:
-                    continue
-                    
-                filename = bouquet_info["filename"]
-                download_url = bouquet_info["download_url"]
-                destination = os.path.join(BOUQUET_PATH, filename)
-                
-                response = requests.get(download_url)
-                response.raise_for_status()
-                
-                content = response.text
-                if not content.startswith("#NAME"):
-                    raise ValueError(f"Invalid bouquet file format: {filename}")
-                
-                with open(destination, "w") as f:
-                    f.write(content)
-                
-                service_line = f'#SERVICE 1:7:1:0:0:0:0:0:0:0:FROM BOUQUET "{filename}" ORDER BY bouquet\n'
-                if os.path.exists(bouquets_tv_path):
-                    with open(bouquets_tv_path, "r") as f:
-                        existing_lines = f.readlines()
-                    if service_line not in existing_lines:
-                        with open(bouquets_tv_path, "a") as f:
-                            f.write(service_line)
-                else:
-                    with open(bouquets_tv_path, "w") as f:
-                        f.write(service_line)
-            
-            self["status"].setText("Bouquets installed successfully!")
-            self.selected_bouquets = []
-            self["right_list"].setList([])
-            
-            self.session.openWithCallback(
-                self.reload_confirm,
-                MessageBox,
-                "Do you want to reload settings now?",
-                MessageBox.TYPE_YESNO
-            )
-            
-        except Exception as e:
-            self["status"].setText(f"Error installing bouquets: {str(e)}")
+        bouquets = [self.bouquet_files[b] for b in self.selected_bouquets if b in self.bouquet_files]
+        job_queue.submit(
+            self, lambda job: install_bouquets(bouquets, job, picons=False),
+            on_done=self.install_finished,
+            on_error=self.install_failed,
+            on_progress=self["status"].setText
+        )
+
+    def install_finished(self, result):
+        self["status"].setText("Bouquets installed successfully!")
+        self.selected_bouquets = []
+        self["right_list"].setList([])
+
+        self.session.openWithCallback(
+            self.reload_confirm,
+            MessageBox,
+            "Do you want to reload settings now?",
+            MessageBox.TYPE_YESNO
+        )
+
+        # Picons do not need a reload, so they are fetched after the prompt
+        installed = result["installed"]
+        job_queue.submit(
+            self, lambda job: install_picons(installed, job),
+            on_done=self.picons_finished,
+            on_error=self.picons_failed,
+            on_progress=self["status"].setText
+        )
+
+    def install_failed(self, e):
+        self["status"].setText(f"Error installing bouquets: {str(e)}")
+
+    def picons_finished(self, result):
+        fetched, present, failed = result
+        self["status"].setText(f"Bouquets installed successfully! Picons: {fetched} new, {present} present, {failed} missing")
+
+    def picons_failed(self, e):
+        self["status"].setText(f"Bouquets installed, picons failed: {str(e)}")
 
     def reload_confirm(self, result):
         if result:
@@ -210,7 +192,7 @@ class CiefpIPTV(Screen):
     def open_viewer(self):
         selected = self["left_list"].getCurrent()
         if selected and selected in self.bouquet_files:
-            self.session.open(BouquetViewer, self.bouquet_files[selected]["download_url"], selected)
+            self.session.open(BouquetViewer, self.bouquet_files[selected]["filename"], selected)
         else:
             self.session.open(MessageBox, "Please select a bouquet to view!", MessageBox.TYPE_ERROR)
 
@@ -221,19 +203,21 @@ class BouquetViewer(Screen):
             <widget name="background" position="850,0" size="350,800" pixmap="/usr/lib/enigma2/python/Plugins/Extensions/CiefpIPTVBouquets/background5.png" zPosition="-1" alphatest="on" />
             <widget name="button_red" position="20,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#9F1313" foregroundColor="#000000" />
             <widget name="button_green" position="220,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#1F771F" foregroundColor="#000000" />
+            <widget name="status" position="420,740" size="430,40" font="Regular;22" />
         </screen>
     """
 
-    def __init__(self, session, bouquet_url, bouquet_name):
+    def __init__(self, session, filename, bouquet_name):
         Screen.__init__(self, session)
         self.session = session
-        self.bouquet_url = bouquet_url
+        self.filename = filename
         self.bouquet_name = bouquet_name
 
         self["channel_list"] = MenuList([])
         self["background"] = Pixmap()
         self["button_red"] = Label("Close")
         self["button_green"] = Label("Select")  # Za buduće proširenje, npr. direktna instalacija
+        self["status"] = Label("")
 
         self["actions"] = ActionMap(["OkCancelActions", "ColorActions"], {
             "ok": self.exit,
@@ -243,20 +227,27 @@ class BouquetViewer(Screen):
         }, -1)
 
         self.onLayoutFinish.append(self.load_channels)
+        self.onClose.append(self.cancel_jobs)
+
+    def cancel_jobs(self):
+        job_queue.cancel_owner(self)
 
     def load_channels(self):
-        try:
-            response = requests.get(self.bouquet_url)
-            response.raise_for_status()
-            content = response.text.splitlines()
-            channels = []
-            for line in content:
-                if line.startswith("#DESCRIPTION"):
-                    channels.append(line.replace("#DESCRIPTION", "").strip())
-            self["channel_list"].setList(channels if channels else ["No channels found in this bouquet"])
-            self.setTitle(f"Bouquet Viewer: {self.bouquet_name}")
-        except Exception as e:
-            self["channel_list"].setList([f"Error loading channels: {str(e)}"])
+        self["status"].setText("Loading channels...")
+        job_queue.submit(
+            self, lambda job: fetch_bouquet_channels(self.filename),
+            on_done=self.channels_loaded,
+            on_error=self.channels_failed
+        )
+
+    def channels_loaded(self, channels):
+        self["channel_list"].setList(channels if channels else ["No channels found in this bouquet"])
+        self["status"].setText(f"{len(channels)} channel(s)")
+        self.setTitle(f"Bouquet Viewer: {self.bouquet_name}")
+
+    def channels_failed(self, e):
+        self["status"].setText("")
+        self["channel_list"].setList([f"Error loading channels: {str(e)}"])
 
     def exit(self):
         self.close()
@@ -270,6 +261,7 @@ class IPTVManager(Screen):
             <widget name="button_green" position="220,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#1F771F" foregroundColor="#000000" />
             <widget name="button_yellow" position="420,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#9F9F13" foregroundColor="#000000" />
             <widget name="button_blue" position="620,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#132B9F" foregroundColor="#000000" />
+            <widget name="status" position="820,740" size="370,40" font="Regular;22" />
         </screen>
     """
 
@@ -285,8 +277,9 @@ class IPTVManager(Screen):
         self["button_green"] = Label("Select")
         self["button_yellow"] = Label("Cleaner")  # Dodato za Cleaner
         self["button_blue"] = Label("IPTV Editor")
+        self["status"] = Label("MENU: more options")
 
-        self["actions"] = ActionMap(["OkCancelActions", "ColorActions", "DirectionActions"], {
+        self["actions"] = ActionMap(["OkCancelActions", "ColorActions", "DirectionActions", "MenuActions"], {
             "ok": self.select_bouquet,
             "cancel": self.exit,
             "up": self.up,
@@ -294,58 +287,21 @@ class IPTVManager(Screen):
             "red": self.delete_selected,
             "green": self.select_bouquet,
             "yellow": self.open_cleaner,  # Dodato za Cleaner
-            "blue": self.open_iptv_editor
+            "blue": self.open_iptv_editor,
+            "menu": self.open_menu
         }, -1)
 
         self.onLayoutFinish.append(self.load_iptv_bouquets)
+        self.onClose.append(self.cancel_jobs)
 
-    def load_iptv_bouquets(self):
-        self.iptv_files = []
-        display_names = []
-        bouquets_order = []
-        
-        bouquets_tv_path = os.path.join(BOUQUET_PATH, "bouquets.tv")
-        if os.path.exists(bouquets_tv_path):
-            with open(bouquets_tv_path, "r") as f:
-                for line in f:
-                    if "#SERVICE" in line and "FROM BOUQUET" in line:
-                        start = line.find('"') + 1
-                        end = line.find('"', start)
-                        if start > 0 and end > start:
-                            filename = line[start:end]
-                            bouquets_order.append(filename)
-
-        all_files = {}
-        for f in os.listdir(BOUQUET_PATH):
-            if (f.startswith("userbouquet.ciefpsettings") or 
-                f.startswith("userbouquet.iptv") or 
-                "iptv" in f.lower()) and f.endswith(".tv"):
-                bouquet_path = os.path.join(BOUQUET_PATH, f)
-                display_name = f
-                
-                try:
-                    with open(bouquet_path, "r") as file:
-                        for line in file:
-                            if line.startswith("#NAME"):
-                                display_name = line.replace("#NAME", "").strip()
-                                break
-                except:
-                    display_name = f.replace("userbouquet.", "").replace(".tv", "")
-                
-                all_files[f] = display_name
-
-        ordered_files = []
-        for filename in bouquets_order:
-            if filename in all_files:
-                ordered_files.append((filename, all_files[filename]))
-                del all_files[filename]
-        
-        for filename, display_name in all_files.items():
-            ordered_files.append((filename, display_name))
+    def cancel_jobs(self):
+        job_queue.cancel_owner(self)
 
+    def load_iptv_bouquets(self):
+        ordered_files = list_iptv_bouquets()
         self.iptv_files = [f[0] for f in ordered_files]
         display_names = [f[1] for f in ordered_files]
-        
+
         if not display_names:
             self["channel_list"].setList(["No IPTV bouquets found"])
         else:
@@ -355,19 +311,8 @@ class IPTVManager(Screen):
         current = self["channel_list"].getCurrent()
         if current and current != "No IPTV bouquets found":
             base_current = current.replace(" [SELECTED]", "")
-            for i, f in enumerate(self.iptv_files):
-                display_name = f
-                bouquet_path = os.path.join(BOUQUET_PATH, f)
-                try:
-                    with open(bouquet_path, "r") as file:
-                        for line in file:
-                            if line.startswith("#NAME"):
-                                display_name = line.replace("#NAME", "").strip()
-                                break
-                except:
-                    display_name = f.replace("userbouquet.", "").replace(".tv", "")
-
-                if display_name == base_current:
+            for f in self.iptv_files:
+                if bouquet_display_name(BOUQUET_PATH, f) == base_current:
                     if base_current in self.selected_bouquets:
                         self.selected_bouquets.remove(base_current)
                     else:
@@ -377,18 +322,8 @@ class IPTVManager(Screen):
 
     def update_list(self):
         display_names = []
-        for i, f in enumerate(self.iptv_files):
-            bouquet_path = os.path.join(BOUQUET_PATH, f)
-            display_name = f
-            try:
-                with open(bouquet_path, "r") as file:
-                    for line in file:
-                        if line.startswith("#NAME"):
-                            display_name = line.replace("#NAME", "").strip()
-                            break
-            except:
-                display_name = f.replace("userbouquet.", "").replace(".tv", "")
-            
+        for f in self.iptv_files:
+            display_name = bouquet_display_name(BOUQUET_PATH, f)
             if display_name in self.selected_bouquets:
                 display_name += " [SELECTED]"
             display_names.append(display_name)
@@ -399,43 +334,35 @@ class IPTVManager(Screen):
             self.session.open(MessageBox, "No bouquets selected for deletion!", MessageBox.TYPE_ERROR)
             return
 
-        try:
-            for bouquet in self.selected_bouquets:
-                for i, f in enumerate(self.iptv_files):
-                    display_name = f
-                    bouquet_path = os.path.join(BOUQUET_PATH, f)
-                    try:
-                        with open(bouquet_path, "r") as file:
-                            for line in file:
-                                if line.startswith("#NAME"):
-                                    display_name = line.replace("#NAME", "").strip()
-                                    break
-                    except:
-                        display_name = f.replace("userbouquet.", "").replace(".tv", "")
-                    
-                    if display_name == bouquet:
-                        os.remove(bouquet_path)
-                        bouquets_tv_path = os.path.join(BOUQUET_PATH, "bouquets.tv")
-                        if os.path.exists(bouquets_tv_path):
-                            with open(bouquets_tv_path, "r") as file:
-                                lines = file.readlines()
-                            with open(bouquets_tv_path, "w") as file:
-                                for line in lines:
-                                    if f not in line:
-                                        file.write(line)
-
-            self.session.open(MessageBox, f"Deleted {len(self.selected_bouquets)} bouquet(s) successfully!", MessageBox.TYPE_INFO)
-            self.selected_bouquets = []
-            self.load_iptv_bouquets()
-            
-            self.session.openWithCallback(
-                self.reload_confirm,
-                MessageBox,
-                "Do you want to reload settings now?",
-                MessageBox.TYPE_YESNO
-            )
-        except Exception as e:
-            self.session.open(MessageBox, f"Error deleting bouquets: {str(e)}", MessageBox.TYPE_ERROR)
+        self["status"].setText("Deleting bouquets...")
+        job_queue.submit(
+            self, self.delete_named_bouquets, list(self.selected_bouquets), list(self.iptv_files),
+            on_done=self.delete_finished,
+            on_error=self.delete_failed,
+            on_progress=self["status"].setText
+        )
+
+    def delete_named_bouquets(self, job, selected_bouquets, iptv_files):
+        filenames = [f for f in iptv_files if bouquet_display_name(BOUQUET_PATH, f) in selected_bouquets]
+        delete_bouquets(filenames, job)
+        return len(selected_bouquets)
+
+    def delete_finished(self, count):
+        self["status"].setText("")
+        self.session.open(MessageBox, f"Deleted {count} bouquet(s) successfully!", MessageBox.TYPE_INFO)
+        self.selected_bouquets = []
+        self.load_iptv_bouquets()
+
+        self.session.openWithCallback(
+            self.reload_confirm,
+            MessageBox,
+            "Do you want to reload settings now?",
+            MessageBox.TYPE_YESNO
+        )
+
+    def delete_failed(self, e):
+        self["status"].setText("")
+        self.session.open(MessageBox, f"Error deleting bouquets: {str(e)}", MessageBox.TYPE_ERROR)
 
     def reload_confirm(self, result):
         if result:
@@ -462,25 +389,132 @@ class IPTVManager(Screen):
     def open_iptv_editor(self):
         current = self["channel_list"].getCurrent()
         if current and current != "No IPTV bouquets found":
-            for i, f in enumerate(self.iptv_files):
-                display_name = f
-                bouquet_path = os.path.join(BOUQUET_PATH, f)
-                try:
-                    with open(bouquet_path, "r") as file:
-                        for line in file:
-                            if line.startswith("#NAME"):
-                                display_name = line.replace("#NAME", "").strip()
-                                break
-                except:
-                    display_name = f.replace("userbouquet.", "").replace(".tv", "")
-                
-                if display_name == current:
-                    self.session.open(IPTVEditor, bouquet_path, f)
+            for f in self.iptv_files:
+                if bouquet_display_name(BOUQUET_PATH, f) == current:
+                    self.session.open(IPTVEditor, os.path.join(BOUQUET_PATH, f), f)
                     break
 
     def open_cleaner(self):
         self.session.open(BouquetCleaner)
 
+    def current_file(self):
+        index = self["channel_list"].getSelectionIndex()
+        if 0 <= index < len(self.iptv_files):
+            return self.iptv_files[index]
+        return None
+
+    def open_menu(self):
+        self.session.openWithCallback(
+            self.menu_selected,
+            ChoiceBox,
+            title="IPTV Manager",
+            list=[
+                ("Search channels", "search"),
+                ("Split bouquet by group", "split"),
+                ("Merge split bouquet", "merge"),
+                ("Create snapshot", "snapshot"),
+                ("Restore snapshot", "restore"),
+            ]
+        )
+
+    def menu_selected(self, choice):
+        if not choice:
+            return
+        if choice[1] == "search":
+            self.session.open(ChannelSearch)
+            return
+        if choice[1] == "snapshot":
+            self["status"].setText("Creating snapshot...")
+            job_queue.submit(
+                self, lambda job: create_snapshot(job),
+                on_done=self.snapshot_created,
+                on_error=self.split_failed,
+                on_progress=self["status"].setText
+            )
+            return
+        if choice[1] == "restore":
+            self.choose_snapshot()
+            return
+        filename = self.current_file()
+        if not filename:
+            self.session.open(MessageBox, "Please select a bouquet!", MessageBox.TYPE_ERROR)
+            return
+        if choice[1] == "split":
+            self["status"].setText("Splitting bouquet...")
+            job_queue.submit(
+                self, lambda job: split_bouquet(filename),
+                on_done=lambda shards: self.split_finished(f"Split into {len(shards)} bouquet(s)!"),
+                on_error=self.split_failed
+            )
+        elif choice[1] == "merge":
+            self["status"].setText("Merging bouquet...")
+            job_queue.submit(
+                self, lambda job: merge_bouquet(filename),
+                on_done=lambda merged: self.split_finished(f"Merged into {merged}!"),
+                on_error=self.split_failed
+            )
+
+    def snapshot_created(self, result):
+        archive_name, files, stored = result
+        self["status"].setText("")
+        self.session.open(
+            MessageBox,
+            f"Snapshot {archive_name} created: {files} file(s), {stored} changed.",
+            MessageBox.TYPE_INFO
+        )
+
+    def choose_snapshot(self):
+        snapshots = list_snapshots()
+        if not snapshots:
+            self.session.open(MessageBox, "No snapshots found!", MessageBox.TYPE_INFO)
+            return
+        self.session.openWithCallback(
+            self.snapshot_chosen,
+            ChoiceBox,
+            title="Restore snapshot",
+            list=[(f"{name} ({len(manifest['files'])} files)", name) for name, manifest in snapshots]
+        )
+
+    def snapshot_chosen(self, choice):
+        if not choice:
+            return
+        self.session.openWithCallback(
+            lambda result: result and self.restore_confirmed(choice[1]),
+            MessageBox,
+            f"Restore {choice[1]}? Current IPTV bouquets will be replaced.",
+            MessageBox.TYPE_YESNO
+        )
+
+    def restore_confirmed(self, archive_name):
+        self["status"].setText("Restoring snapshot...")
+        job_queue.submit(
+            self, lambda job: restore_snapshot(archive_name, job),
+            on_done=self.snapshot_restored,
+            on_error=self.split_failed,
+            on_progress=self["status"].setText
+        )
+
+    def snapshot_restored(self, count):
+        self["status"].setText(f"Restored {count} file(s)")
+        self.selected_bouquets = []
+        self.load_iptv_bouquets()
+        self.reload_settings()
+
+    def split_finished(self, message):
+        self["status"].setText("")
+        self.selected_bouquets = []
+        self.load_iptv_bouquets()
+        self.session.openWithCallback(
+            self.reload_confirm,
+            MessageBox,
+            message + " Do you want to reload settings now?",
+            MessageBox.TYPE_YESNO
+        )
+
+    def split_failed(self, e):
+        self["status"].setText("")
+        self.session.open(MessageBox, f"Error: {str(e)}", MessageBox.TYPE_ERROR)
+
     def up(self):
         self["channel_list"].up()
 
@@ -497,6 +531,8 @@ class BouquetCleaner(Screen):
             <widget name="background" position="850,0" size="350,800" pixmap="/usr/lib/enigma2/python/Plugins/Extensions/CiefpIPTVBouquets/background2.png" zPosition="-1" alphatest="on" />
             <widget name="button_red" position="20,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#9F1313" foregroundColor="#000000" />
             <widget name="button_green" position="220,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#1F771F" foregroundColor="#000000" />
+            <widget name="button_yellow" position="420,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#9F9F13" foregroundColor="#000000" />
+            <widget name="status" position="620,740" size="570,40" font="Regular;22" />
         </screen>
     """
 
@@ -504,12 +540,15 @@ class BouquetCleaner(Screen):
         Screen.__init__(self, session)
         self.session = session
         self.selected_file = None
+        self.garbage = None
         self.del_files = []
 
         self["channel_list"] = MenuList([])
         self["background"] = Pixmap()
         self["button_red"] = Label("Delete")
         self["button_green"] = Label("Select All")
+        self["button_yellow"] = Label("Full Cleanup")
+        self["status"] = Label("")
 
         self["actions"] = ActionMap(["OkCancelActions", "ColorActions"], {
             "ok": self.select_file,
@@ -517,10 +556,15 @@ class BouquetCleaner(Screen):
             "up": self.up,
             "down": self.down,
             "red": self.delete_selected,
-            "green": self.select_all
+            "green": self.select_all,
+            "yellow": self.full_cleanup
         }, -1)
 
         self.onLayoutFinish.append(self.load_deleted_bouquets)
+        self.onClose.append(self.cancel_jobs)
+
+    def cancel_jobs(self):
+        job_queue.cancel_owner(self)
 
     def load_deleted_bouquets(self):
         self.del_files = [f for f in os.listdir(BOUQUET_PATH) if f.endswith(".del")]
@@ -566,6 +610,75 @@ class BouquetCleaner(Screen):
         except Exception as e:
             self.session.open(MessageBox, f"Error deleting files: {str(e)}", MessageBox.TYPE_ERROR)
 
+    def full_cleanup(self):
+        self["status"].setText("Scanning bouquets...")
+        job_queue.submit(
+            self, lambda job: scan_bouquet_garbage(),
+            on_done=self.cleanup_scanned,
+            on_error=self.cleanup_failed
+        )
+
+    def cleanup_scanned(self, garbage):
+        self["status"].setText("")
+        if not any(garbage.values()):
+            self.session.open(MessageBox, "Nothing to clean up!", MessageBox.TYPE_INFO)
+            return
+        self.garbage = garbage
+        self.session.openWithCallback(
+            self.cleanup_confirmed,
+            MessageBox,
+            garbage_report(garbage) + "\n\nRemove all of the above?",
+            MessageBox.TYPE_YESNO
+        )
+
+    def cleanup_confirmed(self, result):
+        if not result:
+            return
+        self["status"].setText("Cleaning up...")
+        job_queue.submit(
+            self, lambda job, garbage: apply_bouquet_garbage(garbage), self.garbage,
+            on_done=self.cleanup_finished,
+            on_error=self.cleanup_failed
+        )
+
+    def cleanup_finished(self, removed):
+        self["status"].setText("")
+        self.garbage = None
+        self.selected_file = None
+        self.load_deleted_bouquets()
+        self.session.openWithCallback(
+            self.reload_confirm,
+            MessageBox,
+            f"Removed {removed} item(s). Do you want to reload settings now?",
+            MessageBox.TYPE_YESNO
+        )
+
+    def cleanup_failed(self, e):
+        self["status"].setText("")
+        self.session.open(MessageBox, f"Error cleaning up bouquets: {str(e)}", MessageBox.TYPE_ERROR)
+
+    def reload_confirm(self, result):
+        if result:
+            self.reload_settings()
+
+    def reload_settings(self):
+        try:
+            eDVBDB.getInstance().reloadServicelist()
+            eDVBDB.getInstance().reloadBouquets()
+            self.session.open(
+                MessageBox,
+                "Reload successful! Settings updated.",
+                MessageBox.TYPE_INFO,
+                timeout=5
+            )
+        except Exception as e:
+            self.session.open(
+                MessageBox,
+                "Reload failed: " + str(e),
+                MessageBox.TYPE_ERROR,
+                timeout=5
+            )
+
     def up(self):
         self["channel_list"].up()
 
@@ -584,14 +697,17 @@ class IPTVEditor(Screen):
             <widget name="button_green" position="170,740" size="140,40" font="Bold;22" halign="center" backgroundColor="#1F771F" foregroundColor="#000000" />
             <widget name="button_yellow" position="320,740" size="140,40" font="Bold;22" halign="center" backgroundColor="#9F9F13" foregroundColor="#000000" />
             <widget name="button_blue" position="470,740" size="140,40" font="Bold;22" halign="center" backgroundColor="#132B9F" foregroundColor="#000000" />
+            <widget name="status" position="630,740" size="560,40" font="Regular;22" />
         </screen>
     """
 
-    def __init__(self, session, bouquet_path, filename):
+    def __init__(self, session, bouquet_path, filename, select_index=None):
         Screen.__init__(self, session)
         self.session = session
         self.bouquet_path = bouquet_path
         self.filename = filename
+        self.select_index = select_index
+        self.sort_key_cache = {}
         self.channels = []
         self.selected_channels = []
         self.move_mode = False
@@ -605,8 +721,9 @@ class IPTVEditor(Screen):
         self["button_green"] = Label("Save")
         self["button_yellow"] = Label("Move Mode")
         self["button_blue"] = Label("Select Similar")
+        self["status"] = Label("MENU: sort")
 
-        self["actions"] = ActionMap(["OkCancelActions", "ColorActions", "DirectionActions"], {
+        self["actions"] = ActionMap(["OkCancelActions", "ColorActions", "DirectionActions", "MenuActions"], {
             "ok": self.select_channel,
             "cancel": self.exit,
             "up": self.up,
@@ -616,34 +733,27 @@ class IPTVEditor(Screen):
             "red": self.delete_selected,
             "green": self.save_changes,
             "yellow": self.toggle_move_mode,
-            "blue": self.select_similar
+            "blue": self.select_similar,
+            "menu": self.open_sort_menu
         }, -1)
 
         self.onLayoutFinish.append(self.load_channels)
+        self.onClose.append(self.cancel_jobs)
+
+    def cancel_jobs(self):
+        job_queue.cancel_owner(self)
 
     def load_channels(self):
         self.channels = []
         self.channel_names = []
         try:
-            with open(self.bouquet_path, "r") as file:
-                current_channel = None
-                for line in file:
-                    line = line.strip()
-                    if line.startswith("#NAME"):
-                        self.bouquet_name = line.replace("#NAME", "").strip()
-                    elif line.startswith("#SERVICE"):
-                        if current_channel:
-                            self.channels.append(current_channel)
-                        current_channel = {"service": line, "description": ""}
-                    elif line.startswith("#DESCRIPTION") and current_channel:
-                        current_channel["description"] = line.replace("#DESCRIPTION", "").strip()
-                
-                if current_channel:
-                    self.channels.append(current_channel)
-            
+            self.bouquet_name, self.channels = read_bouquet(self.bouquet_path)
+            self.sort_key_cache = {}
             self.original_channels = self.channels.copy()
             self.channel_names = [channel["description"] or channel["service"] for channel in self.channels]
             self.update_list()
+            if self.select_index is not None and self.select_index < len(self.channels):
+                self["channel_list"].moveToIndex(self.select_index)
         except Exception as e:
             self["channel_list"].setList(["Error loading channels"])
             self.session.open(MessageBox, f"Error loading channels: {str(e)}", MessageBox.TYPE_ERROR)
@@ -677,33 +787,10 @@ class IPTVEditor(Screen):
             return
         current_name = self.channels[current_index]["description"] or self.channels[current_index]["service"]
 
-        if ":" in current_name:
-            base_prefix = current_name.split(":")[0] + ":"
-            similar_channels = [
-                i for i, channel in enumerate(self.channels)
-                if (channel["description"] or channel["service"]).startswith(base_prefix)
-            ]
-            all_selected = all(i in self.selected_channels for i in similar_channels)
-            if all_selected and similar_channels:
-                self.selected_channels = [i for i in self.selected_channels if i not in similar_channels]
-            elif similar_channels:
-                self.selected_channels = list(set(self.selected_channels + similar_channels))
-            else:
-                self.session.open(MessageBox, f"No similar channels found for: {current_name}", MessageBox.TYPE_INFO)
-            self.update_list()
-            return
-
-        if (match := re.match(r"(.*?)\s+S\d+\s+E\d+", current_name, re.IGNORECASE)):
-            base_prefix = match.group(1) + " "
-        elif current_name.startswith("24/7 "):
-            base_prefix = "24/7 "
-        else:
-            parts = current_name.split(" ", 2)
-            base_prefix = parts[0] + " " if len(parts) > 1 else current_name + " "
-            if len(parts) > 2 and parts[1] in ["Premiere", "Series", "Episode", "TV+"]:
-                base_prefix = f"{parts[0]} {parts[1]} "
-
+        base_prefix = similar_prefix(current_name)
         base_name = base_prefix.rstrip()
+        if base_prefix.endswith(":"):
+            base_name = None
         similar_channels = [
             i for i, channel in enumerate(self.channels)
             if (channel["description"] or channel["service"]).startswith(base_prefix) or
@@ -718,6 +805,31 @@ class IPTVEditor(Screen):
             self.session.open(MessageBox, f"No similar channels found for: {current_name}", MessageBox.TYPE_INFO)
         self.update_list()
 
+    def open_sort_menu(self):
+        self.session.openWithCallback(
+            self.sort_selected,
+            ChoiceBox,
+            title="Sort channels",
+            list=[(label, mode) for mode, label in SORT_MODES]
+        )
+
+    def sort_selected(self, choice):
+        if not choice:
+            return
+        # Sorting 100k channels takes a fraction of a second, so it runs
+        # right here and cannot race with moves or deletes in the list
+        started = time.monotonic()
+        try:
+            self.channels = sort_channels(self.channels, choice[1], self.sort_key_cache)
+        except Exception as e:
+            self["status"].setText(f"Error sorting: {str(e)}")
+            return
+        elapsed = time.monotonic() - started
+        self.selected_channels = []
+        self.update_list()
+        self["channel_list"].moveToIndex(0)
+        self["status"].setText(f"Sorted {len(self.channels)} channel(s) in {elapsed:.2f}s")
+
     def toggle_move_mode(self):
         self.move_mode = not self.move_mode
         self["button_yellow"].setText("Move Mode" if not self.move_mode else "Disable Move")
@@ -795,25 +907,29 @@ class IPTVEditor(Screen):
             self.session.open(MessageBox, "No changes to save!", MessageBox.TYPE_INFO)
             return
 
-        try:
-            with open(self.bouquet_path, "w") as file:
-                file.write(f"#NAME {self.bouquet_name}\n")
-                for channel in self.channels:
-                    file.write(f"{channel['service']}\n")
-                    if channel["description"]:
-                        file.write(f"#DESCRIPTION {channel['description']}\n")
-            
-            self.original_channels = self.channels.copy()
-            self.session.open(MessageBox, "Changes saved successfully!", MessageBox.TYPE_INFO)
-            
-            self.session.openWithCallback(
-                self.reload_confirm,
-                MessageBox,
-                "Do you want to reload settings now?",
-                MessageBox.TYPE_YESNO
-            )
-        except Exception as e:
-            self.session.open(MessageBox, f"Error saving changes: {str(e)}", MessageBox.TYPE_ERROR)
+        self["status"].setText("Saving changes...")
+        job_queue.submit(
+            self, lambda job, bouquet_name, channels: write_bouquet(self.bouquet_path, bouquet_name, channels),
+            self.bouquet_name, list(self.channels),
+            on_done=self.save_finished,
+            on_error=self.save_failed
+        )
+
+    def save_finished(self, channels):
+        self["status"].setText("")
+        self.original_channels = channels
+        self.session.open(MessageBox, "Changes saved successfully!", MessageBox.TYPE_INFO)
+
+        self.session.openWithCallback(
+            self.reload_confirm,
+            MessageBox,
+            "Do you want to reload settings now?",
+            MessageBox.TYPE_YESNO
+        )
+
+    def save_failed(self, e):
+        self["status"].setText("")
+        self.session.open(MessageBox, f"Error saving changes: {str(e)}", MessageBox.TYPE_ERROR)
 
     def reload_confirm(self, result):
         if result:
@@ -852,6 +968,127 @@ class IPTVEditor(Screen):
         if result:
             self.close()
 
+class ChannelSearch(Screen):
+    skin = """
+        <screen name="channelsearch" position="center,center" size="1200,800" title="..:: Channel Search ::..">
+            <widget name="query" position="20,20" size="830,40" font="Regular;30" />
+            <widget name="result_list" position="20,70" size="830,650" scrollbarMode="showOnDemand" itemHeight="33" font="Regular;28" />
+            <widget name="background" position="850,0" size="350,800" pixmap="/usr/lib/enigma2/python/Plugins/Extensions/CiefpIPTVBouquets/background3.png" zPosition="-1" alphatest="on" />
+            <widget name="button_red" position="20,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#9F1313" foregroundColor="#000000" />
+            <widget name="button_green" position="220,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#1F771F" foregroundColor="#000000" />
+            <widget name="button_yellow" position="420,740" size="180,40" font="Bold;22" halign="center" backgroundColor="#9F9F13" foregroundColor="#000000" />
+            <widget name="status" position="620,740" size="570,40" font="Regular;22" />
+        </screen>
+    """
+
+    def __init__(self, session):
+        Screen.__init__(self, session)
+        self.session = session
+        self.results = []
+        self.ready = False
+
+        self["query"] = Input("", maxSize=False, type=Input.TEXT, allMarked=False)
+        self["result_list"] = MenuList([])
+        self["background"] = Pixmap()
+        self["button_red"] = Label("Backspace")
+        self["button_green"] = Label("Open")
+        self["button_yellow"] = Label("Clear")
+        self["status"] = Label("Loading index...")
+
+        self["actions"] = NumberActionMap(["OkCancelActions", "ColorActions", "DirectionActions", "NumberActions", "InputAsciiActions"], {
+            "ok": self.open_result,
+            "cancel": self.exit,
+            "up": self.up,
+            "down": self.down,
+            "left": self.page_up,
+            "right": self.page_down,
+            "red": self.backspace,
+            "green": self.open_result,
+            "yellow": self.clear,
+            "gotAsciiCode": self.got_ascii,
+            "1": self.key_number,
+            "2": self.key_number,
+            "3": self.key_number,
+            "4": self.key_number,
+            "5": self.key_number,
+            "6": self.key_number,
+            "7": self.key_number,
+            "8": self.key_number,
+            "9": self.key_number,
+            "0": self.key_number
+        }, -1)
+
+        self.onLayoutFinish.append(self.update_index)
+        self.onClose.append(self.cancel_jobs)
+
+    def cancel_jobs(self):
+        job_queue.cancel_owner(self)
+        eRCInput.getInstance().setKeyboardMode(eRCInput.kmNone)
+
+    def update_index(self):
+        eRCInput.getInstance().setKeyboardMode(eRCInput.kmAscii)
+        job_queue.submit(
+            self, lambda job: channel_index.update(job=job),
+            on_done=self.index_ready,
+            on_error=self.index_failed,
+            on_progress=self["status"].setText
+        )
+
+    def index_ready(self, changed):
+        self.ready = True
+        count = sum(len(indexed["names"]) for indexed in channel_index.files.values())
+        self["status"].setText(f"{count} channels in {len(channel_index.files)} bouquet(s)")
+        self.search()
+
+    def index_failed(self, e):
+        self["status"].setText(f"Error building index: {str(e)}")
+
+    def search(self):
+        if not self.ready:
+            return
+        query = self["query"].getText()
+        self.results = channel_index.search(query)
+        self["result_list"].setList([f"{name}  ({bouquet_name})" for filename, row, name, bouquet_name in self.results])
+        if len(query.strip()) >= SEARCH_MIN_LENGTH:
+            self["status"].setText(f"{len(self.results)} match(es)")
+
+    def got_ascii(self):
+        self["query"].handleAscii(getPrevAsciiCode())
+        self.search()
+
+    def key_number(self, number):
+        self["query"].number(number)
+        self.search()
+
+    def backspace(self):
+        self["query"].deleteBackward()
+        self.search()
+
+    def clear(self):
+        self["query"].setText("")
+        self.search()
+
+    def open_result(self):
+        index = self["result_list"].getSelectionIndex()
+        if 0 <= index < len(self.results):
+            filename, row, name, bouquet_name = self.results[index]
+            self.session.open(IPTVEditor, os.path.join(BOUQUET_PATH, filename), filename, row)
+
+    def up(self):
+        self["result_list"].up()
+
+    def down(self):
+        self["result_list"].down()
+
+    def page_up(self):
+        self["result_list"].pageUp()
+
+    def page_down(self):
+        self["result_list"].pageDown()
+
+    def exit(self):
+        self.close()
+
 def main(session, **kwargs):
     session.open(CiefpIPTV)
 